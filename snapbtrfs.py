@@ -35,13 +35,24 @@ It has to be called periodically, by a systemd timer or by cron (/etc/cron.hourl
 VERSION:
 """
 
+import array
 import bisect
+import collections
+import concurrent.futures
 import datetime
+import errno
+import fcntl
 import functools
+import itertools
+import operator
 import os
-import pathlib
+import pickle
 import re
+import struct
 import subprocess
+import sys
+import threading
+import traceback
 
 import yaml
 
@@ -54,7 +65,12 @@ if DEBUG:
 else:
     CFG_FILE = "/etc/snapbtrfs.conf.yaml"
 
+# location of the parsed configuration cache
+CFG_CACHE_FILE = CFG_FILE + ".cache.pkl"
+
 # keys used for period configuration
+# shortest period first: it is the most likely to lack a snapshot, which allows
+# to stop checking the other periods early
 PERIOD_KEYS = (
     "hourly",
     "daily",
@@ -63,230 +79,278 @@ PERIOD_KEYS = (
     "yearly",
 )
 
+# maximum number of volumes processed in parallel
+MAX_WORKERS = 8
+
+# serialize the output of the volumes processed in parallel
+OUTPUT_LOCK = threading.Lock()
+
+# format of the snapshot names, in localtime
+SNAPSHOT_NAME_FORMAT = "%Y-%m-%d-%H:%M:%S"
+# matching regex, to recognize the snapshot names
+SNAPSHOT_NAME_RE = re.compile(r"\d{4}-\d\d-\d\d-\d\d:\d\d:\d\d")
+
+# inode number of the root directory of any btrfs subvolume
+BTRFS_FIRST_FREE_OBJECTID = 256
+
+# BTRFS_IOC_GET_SUBVOL_INFO ioctl, from linux/btrfs.h (Linux >= 4.18):
+# _IOR(BTRFS_IOCTL_MAGIC, 60, struct btrfs_ioctl_get_subvol_info_args)
+BTRFS_IOC_GET_SUBVOL_INFO = 0x81F8943C
+# size of struct btrfs_ioctl_get_subvol_info_args
+BTRFS_SUBVOL_INFO_SIZE = 504
+# offset of the otime field (creation time: __u64 sec, __u32 nsec)
+BTRFS_SUBVOL_INFO_OTIME_OFFSET = 392
+
+# line of 'btrfs subvolume list -s -t' output: ID, gen, cgen, top level, otime
+# and path (otime is only displayed with -s)
+BTRFS_LIST_LINE_RE = re.compile(
+    rb"^\d+\s+\d+\s+\d+\s+\d+\s+(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\s+(\S.*?)\s*$",
+    flags=re.MULTILINE,
+)
+
+
+# Helper functions for datetime manipulation
+# Localtime dependent functions are memoized: the same boundaries are computed
+# for every volume
+
 
-class DateTimeUtil:
+def memoize_boundary(func):
     """
-    Helper functions for datetime manipulation
+    Memoize a localtime dependent boundary function
+    Note: aware datetimes of the same instant are equal, whatever their tzinfo: the
+    result is memoized per instant, and expressed in the tzinfo of each argument
     """
+    cached_func = functools.lru_cache(maxsize=4096)(func)
 
-    @staticmethod
-    def round_beginning_hour(ts: datetime.datetime) -> datetime.datetime:
-        """
-        Round to the beginning of the current hour
-        Note: no concern with localtime / DST (at least for whole hour timezones)
-        """
-        return ts.replace(minute=0, second=0, microsecond=0)
+    @functools.wraps(func)
+    def wrapper(ts: datetime.datetime) -> datetime.datetime:
+        return cached_func(ts).astimezone(ts.tzinfo)
 
-    @staticmethod
-    def round_beginning_day(ts: datetime.datetime) -> datetime.datetime:
-        """
-        Round to the beginning of the current day
-        Note: we want hour=0 in localtime, even for DST switch day
-        """
-        ts = DateTimeUtil.round_beginning_hour(ts)
-        local = ts.astimezone()
-        if local.hour == 0:
-            return ts
-        # remove local hours
-        ts -= datetime.timedelta(hours=local.hour)
-        local = ts.astimezone()
-        if local.hour == 0:
-            return ts
-        # DST adjustment
-        if local.hour == 1:
-            return ts - datetime.timedelta(hours=1)
-        return ts + datetime.timedelta(hours=1)
-
-    @staticmethod
-    def round_beginning_week(ts: datetime.datetime) -> datetime.datetime:
-        """
-        Round to the beginning of the current week (Monday)
-        Note: we want hour=0, weekday=0 in localtime
-        """
-        ts = DateTimeUtil.round_beginning_day(ts)
-        local = ts.astimezone()
-        weekday = local.weekday()
-        if weekday == 0:
-            return ts
-        # remove the needed days, but keeping half a day to protect for DST switch
-        ts -= datetime.timedelta(hours=24 * (weekday - 1) + 12)
-        return DateTimeUtil.round_beginning_day(ts)
-
-    @staticmethod
-    def round_beginning_month(ts: datetime.datetime) -> datetime.datetime:
-        """
-        Round to the beginning of the current month
-        Note: we want hour=0, day=1 in localtime
-        """
-        ts = DateTimeUtil.round_beginning_day(ts)
-        local = ts.astimezone()
-        if local.day == 1:
-            return ts
-        # remove the needed days, but keeping half a day to protect for DST switch
-        ts -= datetime.timedelta(hours=24 * (local.day - 2) + 12)
-        return DateTimeUtil.round_beginning_day(ts)
-
-    @staticmethod
-    def round_beginning_year(ts: datetime.datetime) -> datetime.datetime:
-        """
-        Round to the beginning of the current year
-        Note: we want hour=0, day=1, month=1 in localtime
-        """
-        ts = DateTimeUtil.round_beginning_day(ts)
-        local = ts.astimezone()
-        if (local.month, local.day) == (1, 1):
-            return ts
-        # remove the needed days, but keeping half a day to protect for DST switch
-        yday = local.toordinal() - datetime.datetime(local.year, 1, 1).toordinal()
-        ts -= datetime.timedelta(hours=24 * (yday - 1) + 12)
-        return DateTimeUtil.round_beginning_day(ts)
-
-    @staticmethod
-    def prev_hour(ts: datetime.datetime) -> datetime.datetime:
-        """
-        Return previous hour boundary
-        Note: no concern with localtime / DST (at least for whole hour timezones)
-        """
-        if (ts.minute, ts.second, ts.microsecond) != (0, 0, 0):
-            return DateTimeUtil.round_beginning_hour(ts)
-        return ts - datetime.timedelta(hours=1)
+    wrapper.cache_clear = cached_func.cache_clear
+    return wrapper
 
-    @staticmethod
-    def prev_day(ts: datetime.datetime) -> datetime.datetime:
-        """
-        Return previous day boundary
-        """
-        local = ts.astimezone()
-        if (local.hour, local.minute, local.second, local.microsecond) != (0, 0, 0, 0):
-            return DateTimeUtil.round_beginning_day(ts)
-        return DateTimeUtil.round_beginning_day(ts - datetime.timedelta(hours=12))
 
-    @staticmethod
-    def prev_week(ts: datetime.datetime) -> datetime.datetime:
-        """
-        Return previous week boundary
-        """
-        local = ts.astimezone()
-        if (
-            local.weekday(),
-            local.hour,
-            local.minute,
-            local.second,
-            local.microsecond,
-        ) != (0, 0, 0, 0, 0):
-            return DateTimeUtil.round_beginning_week(ts)
-        return DateTimeUtil.round_beginning_week(ts - datetime.timedelta(days=1))
-
-    @staticmethod
-    def prev_month(ts: datetime.datetime) -> datetime.datetime:
-        """
-        Return previous month boundary
-        """
-        local = ts.astimezone()
-        if (local.day, local.hour, local.minute, local.second, local.microsecond) != (
-            1,
-            0,
-            0,
-            0,
-            0,
-        ):
-            return DateTimeUtil.round_beginning_month(ts)
-        return DateTimeUtil.round_beginning_month(ts - datetime.timedelta(days=1))
-
-    @staticmethod
-    def prev_year(ts: datetime.datetime) -> datetime.datetime:
-        """
-        Return previous year boundary
-        """
-        local = ts.astimezone()
-        if (
-            local.month,
-            local.day,
-            local.hour,
-            local.minute,
-            local.second,
-            local.microsecond,
-        ) != (1, 1, 0, 0, 0, 0):
-            return DateTimeUtil.round_beginning_year(ts)
-        return DateTimeUtil.round_beginning_year(ts - datetime.timedelta(days=1))
-
-    map_prev_period = {
-        "hourly": prev_hour.__func__,
-        "daily": prev_day.__func__,
-        "weekly": prev_week.__func__,
-        "monthly": prev_month.__func__,
-        "yearly": prev_year.__func__,
-    }
-
-    @staticmethod
-    def prev_period(period: str, ts: datetime.datetime) -> datetime.datetime:
-        """
-        Return previous boundary for the given period
-        """
-        return DateTimeUtil.map_prev_period[period](ts)
+def round_beginning_hour(ts: datetime.datetime) -> datetime.datetime:
+    """
+    Round to the beginning of the current hour
+    Note: no concern with localtime / DST (at least for whole hour timezones)
+    """
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def local_midnight(ordinal: int, tzinfo: datetime.tzinfo) -> datetime.datetime:
+    """
+    Return 00:00 localtime of the day given by its proleptic Gregorian ordinal,
+    expressed in tzinfo
+    Note: the naive datetime is interpreted in localtime, with the applicable DST
+    """
+    midnight = datetime.datetime.fromordinal(ordinal)
+    local = midnight.astimezone()
+    if local.toordinal() != ordinal:
+        # 00:00 does not exist (DST switch at midnight, e.g. America/Sao_Paulo) and
+        # falls in the previous day: the day begins at the switch, 00:00 with the
+        # offset before the switch
+        local = midnight.replace(tzinfo=local.tzinfo)
+    return local.astimezone(tzinfo)
+
+
+@memoize_boundary
+def round_beginning_day(ts: datetime.datetime) -> datetime.datetime:
+    """
+    Round to the beginning of the current day
+    Note: we want hour=0 in localtime, even for DST switch day
+    """
+    local = ts.astimezone()
+    return local_midnight(local.toordinal(), ts.tzinfo)
+
+
+@memoize_boundary
+def round_beginning_week(ts: datetime.datetime) -> datetime.datetime:
+    """
+    Round to the beginning of the current week (Monday)
+    Note: we want hour=0, weekday=0 in localtime
+    """
+    local = ts.astimezone()
+    return local_midnight(local.toordinal() - local.weekday(), ts.tzinfo)
+
+
+@memoize_boundary
+def round_beginning_month(ts: datetime.datetime) -> datetime.datetime:
+    """
+    Round to the beginning of the current month
+    Note: we want hour=0, day=1 in localtime
+    """
+    local = ts.astimezone()
+    return local_midnight(local.toordinal() - local.day + 1, ts.tzinfo)
+
+
+@memoize_boundary
+def round_beginning_year(ts: datetime.datetime) -> datetime.datetime:
+    """
+    Round to the beginning of the current year
+    Note: we want hour=0, day=1, month=1 in localtime
+    """
+    local = ts.astimezone()
+    return local_midnight(datetime.date(local.year, 1, 1).toordinal(), ts.tzinfo)
+
+
+def prev_hour(ts: datetime.datetime) -> datetime.datetime:
+    """
+    Return previous hour boundary
+    Note: no concern with localtime / DST (at least for whole hour timezones)
+    """
+    if (ts.minute, ts.second, ts.microsecond) != (0, 0, 0):
+        return round_beginning_hour(ts)
+    return ts - datetime.timedelta(hours=1)
+
+
+@memoize_boundary
+def prev_day(ts: datetime.datetime) -> datetime.datetime:
+    """
+    Return previous day boundary
+    """
+    begin = round_beginning_day(ts)
+    if begin != ts:
+        return begin
+    return local_midnight(ts.astimezone().toordinal() - 1, ts.tzinfo)
+
+
+@memoize_boundary
+def prev_week(ts: datetime.datetime) -> datetime.datetime:
+    """
+    Return previous week boundary
+    """
+    begin = round_beginning_week(ts)
+    if begin != ts:
+        return begin
+    return local_midnight(ts.astimezone().toordinal() - 7, ts.tzinfo)
+
+
+@memoize_boundary
+def prev_month(ts: datetime.datetime) -> datetime.datetime:
+    """
+    Return previous month boundary
+    """
+    begin = round_beginning_month(ts)
+    if begin != ts:
+        return begin
+    ordinal = ts.astimezone().toordinal()
+    # go back by the number of days of the previous month
+    ordinal -= datetime.date.fromordinal(ordinal - 1).day
+    return local_midnight(ordinal, ts.tzinfo)
+
+
+@memoize_boundary
+def prev_year(ts: datetime.datetime) -> datetime.datetime:
+    """
+    Return previous year boundary
+    """
+    begin = round_beginning_year(ts)
+    if begin != ts:
+        return begin
+    year = ts.astimezone().year - 1
+    return local_midnight(datetime.date(year, 1, 1).toordinal(), ts.tzinfo)
+
+
+MAP_ROUND_BEGINNING_PERIOD = {
+    "hourly": round_beginning_hour,
+    "daily": round_beginning_day,
+    "weekly": round_beginning_week,
+    "monthly": round_beginning_month,
+    "yearly": round_beginning_year,
+}
+
+MAP_PREV_PERIOD = {
+    "hourly": prev_hour,
+    "daily": prev_day,
+    "weekly": prev_week,
+    "monthly": prev_month,
+    "yearly": prev_year,
+}
+
+
+def round_beginning_period(period: str, ts: datetime.datetime) -> datetime.datetime:
+    """
+    Round to the beginning of the current given period
+    """
+    return MAP_ROUND_BEGINNING_PERIOD[period](ts)
+
+
+def prev_period(period: str, ts: datetime.datetime) -> datetime.datetime:
+    """
+    Return previous boundary for the given period
+    """
+    return MAP_PREV_PERIOD[period](ts)
+
+
+def parse_naive_ts(ts_str: str) -> datetime.datetime:
+    """
+    Parse a timestamp starting with year, month, day, hour, minute and second
+    at fixed positions, like "%Y-%m-%d %H:%M:%S"
+    Note: much faster than strptime, which is not needed for these fixed formats
+    """
+    return datetime.datetime(
+        int(ts_str[0:4]),
+        int(ts_str[5:7]),
+        int(ts_str[8:10]),
+        int(ts_str[11:13]),
+        int(ts_str[14:16]),
+        int(ts_str[17:19]),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def fixed_timezone(offset: int) -> datetime.timezone:
+    """
+    Return the timezone with the given UTC offset, in minutes
+    Note: memoized, all the timestamps share a handful of offsets
+    """
+    return datetime.timezone(datetime.timedelta(minutes=offset))
+
+
+def parse_ts_str(ts_str: str) -> datetime.datetime:
+    """
+    Parse a "%Y-%m-%d %H:%M:%S %z" timestamp, with a +HHMM / -HHMM offset
+    """
+    offset = int(ts_str[21:23]) * 60 + int(ts_str[23:25])
+    if ts_str[20] == "-":
+        offset = -offset
+    return parse_naive_ts(ts_str).replace(tzinfo=fixed_timezone(offset))
 
 
-@functools.total_ordering
 class ExistingSnapshot:
     """
     Represents an existing snapshot
     """
 
-    env = None  # cache
+    # no per instance dict: there is one instance per snapshot
+    __slots__ = ("path", "ts_str", "ts", "key", "key_epoch", "is_kept")
 
     def __init__(
         self,
-        path: pathlib.Path = None,
+        path: str = None,
         ts: datetime.datetime = None,
         ts_str: str = None,
     ):
+        self.path = path
+        self.ts_str = ts_str
         if ts:
             self.ts = ts
         else:
-            if path:
-                self.path = path
-                self.ts_str = ExistingSnapshot.get_snapshot_creation_time_str(self.path)
-            else:
-                self.ts_str = ts_str
-            self.ts = datetime.datetime.strptime(self.ts_str, "%Y-%m-%d %H:%M:%S %z")
+            self.ts = parse_ts_str(self.ts_str)
 
         # key = round ts to previous hour
-        self.key = DateTimeUtil.round_beginning_hour(self.ts)
+        self.key = round_beginning_hour(self.ts)
+        # key as POSIX timestamp, for cheap comparisons
+        self.key_epoch = int(self.key.timestamp())
         self.is_kept = False
 
-    def __lt__(self, other):
-        return self.key < other.key
-
-    def __eq__(self, other):
-        return self.key == other.key
-
     def keep(self) -> None:
         """
         Mark the ExistingSnapshot as 'to be kept'
         """
         self.is_kept = True
 
-    @classmethod
-    def get_snapshot_creation_time_str(cls, path: pathlib.Path) -> str:
-        """
-        Get creation time of the given snapshot
-        """
-        if cls.env is None:
-            cls.env = os.environ.copy()
-            cls.env[  # pylint: disable=unsupported-assignment-operation
-                "LANG"
-            ] = "C"  # enforce LANG=C to avoid any translation
-        result = subprocess.run(
-            ["btrfs", "subvolume", "show", path.as_posix()],
-            check=True,
-            text=True,
-            capture_output=True,
-            env=cls.env,
-        )
-        return re.search(
-            r"^\s*Creation time:\s*(\w.*)$", result.stdout, flags=re.MULTILINE
-        ).group(1)
-
 
 class ExistingSnapshotsCollection:
     """
@@ -295,23 +359,54 @@ class ExistingSnapshotsCollection:
 
     def __init__(self):
         self.collection = []
+        # snap.key of the sorted collection, as POSIX timestamps in a C int64 array,
+        # compared to the float timestamp() of the bounds (exact for bounds with
+        # fractional seconds) instead of timezone aware datetimes
+        self.keys = array.array("q")
         self.sorted = True
+        self.frozen = False
+
+    def check_not_frozen(self) -> None:
+        """
+        Raise RuntimeError if the collection is frozen
+        """
+        if self.frozen:
+            raise RuntimeError("cannot add snapshots to a frozen collection")
 
     def add(self, snap: ExistingSnapshot) -> None:
         """
         Add existing snapshot in the collection
         """
+        self.check_not_frozen()
         self.collection.append(snap)
         self.sorted = False
 
+    def extend(self, snaps) -> None:
+        """
+        Add several existing snapshots in the collection
+        """
+        self.check_not_frozen()
+        self.collection.extend(snaps)
+        self.sorted = False
+
     def sort(self) -> None:
         """
         Sort the existing snapshots by date
         """
         if not self.sorted:
-            self.collection.sort(key=lambda snap: snap.key)
+            self.collection.sort(key=operator.attrgetter("key_epoch"))
+            self.keys = array.array("q", (snap.key_epoch for snap in self.collection))
             self.sorted = True
 
+    def freeze(self) -> None:
+        """
+        Sort the existing snapshots, and store them in an exactly sized tuple
+        Note: no snapshot can be added afterwards
+        """
+        self.sort()
+        self.collection = tuple(self.collection)
+        self.frozen = True
+
     def find_oldest_in_window(
         self, begin: datetime.datetime, end: datetime.datetime
     ) -> ExistingSnapshot:
@@ -320,36 +415,142 @@ class ExistingSnapshotsCollection:
         begin <= snap.key < end
         """
         self.sort()
-        index = bisect.bisect_left(self.collection, ExistingSnapshot(ts=begin))
-        if index >= len(self.collection):
-            return None  # no element whose snap.key >= begin
-        snap = self.collection[index]
-        if snap.key < end:
-            return snap
+        index = bisect.bisect_left(self.keys, begin.timestamp())
+        if index < len(self.keys) and self.keys[index] < end.timestamp():
+            return self.collection[index]
         return None
 
     def mark_period(self, now: datetime.datetime, period: str, nb_kept: int) -> None:
         """
-        Mark snapshots to be kept for a period type
+        Mark snapshots to be kept for a period type:
+        the oldest snapshot of each of the nb_kept last periods having snapshots
         """
         self.sort()
-        end = now
-        while nb_kept > 0 and self.collection and end >= self.collection[0].ts:
-            begin = DateTimeUtil.prev_period(period, end)
-            snap = self.find_oldest_in_window(begin, end)
-            if snap:
-                snap.keep()
-                nb_kept -= 1
-            end = begin
+        # group the snapshots older than now by period, newest period first
+        newest_first = reversed(
+            self.collection[: bisect.bisect_left(self.keys, now.timestamp())]
+        )
+        groups = itertools.groupby(
+            newest_first,
+            key=lambda snap: round_beginning_period(period, snap.key),
+        )
+        for _, snaps in itertools.islice(groups, max(nb_kept, 0)):
+            *_, oldest = snaps
+            oldest.keep()
 
     def has_snapshop_in_last_period(self, now: datetime.datetime, period: str) -> bool:
         """
         Indicate if the collection already contains a snapshot in the given period
         """
-        return (
-            self.find_oldest_in_window(DateTimeUtil.prev_period(period, now), now)
-            is not None
+        return self.find_oldest_in_window(prev_period(period, now), now) is not None
+
+
+def parse_snapshot_name(name: str) -> datetime.datetime:
+    """
+    Get creation time of a snapshot from its name
+    Return None if the name does not follow SNAPSHOT_NAME_FORMAT
+    """
+    if not SNAPSHOT_NAME_RE.fullmatch(name):
+        return None
+    try:
+        ts = parse_naive_ts(name)
+    except ValueError:
+        return None  # out of range field
+    # interpret in localtime, with the DST offset applicable at that date
+    return ts.astimezone()
+
+
+def get_snapshot_creation_time(path: str) -> datetime.datetime:
+    """
+    Get creation time of the given snapshot, directly from the kernel
+    Return None if the BTRFS_IOC_GET_SUBVOL_INFO ioctl is not supported
+    """
+    buf = bytearray(BTRFS_SUBVOL_INFO_SIZE)
+    dir_fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        fcntl.ioctl(dir_fd, BTRFS_IOC_GET_SUBVOL_INFO, buf)
+    except OSError as exc:
+        if exc.errno == errno.ENOTTY:
+            return None  # unknown ioctl (Linux < 4.18)
+        raise
+    finally:
+        os.close(dir_fd)
+    sec, nsec = struct.unpack_from("=QI", buf, BTRFS_SUBVOL_INFO_OTIME_OFFSET)
+    ts = datetime.datetime.fromtimestamp(sec, datetime.timezone.utc)
+    return ts + datetime.timedelta(microseconds=nsec // 1000)
+
+
+def get_snapshots_creation_time(
+    btrfs_root: str, btrfs_snaps_vol: str, names: list
+) -> list:
+    """
+    Get creation time of the given snapshots located in btrfs_snaps_vol,
+    using a single btrfs command
+    Raise RuntimeError if a snapshot is not listed by btrfs
+    """
+    result = subprocess.run(
+        ["btrfs", "subvolume", "list", "-o", "-s", "-t", btrfs_snaps_vol],
+        check=True,
+        capture_output=True,
+        env=dict(os.environ, LANG="C"),  # enforce LANG=C to avoid any translation
+    )
+    # output is parsed as bytes: fields are ASCII, and paths are decoded the same
+    # way as the names returned by os.scandir
+    snaps_vol_rel = os.fsencode(os.path.relpath(btrfs_snaps_vol, btrfs_root))
+    creation_times = {}
+    for match in BTRFS_LIST_LINE_RE.finditer(result.stdout):
+        parent, _, name = match.group(2).rpartition(b"/")
+        if parent == snaps_vol_rel:
+            # otime is displayed in localtime
+            creation_times[os.fsdecode(name)] = parse_naive_ts(
+                match.group(1).decode("ascii")
+            ).astimezone()
+    missing = [name for name in names if name not in creation_times]
+    if missing:
+        raise RuntimeError(
+            f"no creation time in 'btrfs subvolume list' output for snapshots "
+            f"{', '.join(missing)} of {btrfs_snaps_vol}"
         )
+    return [creation_times[name] for name in names]
+
+
+def load_config() -> dict:
+    """
+    Read the configuration
+    The parsed configuration is cached with the status of the configuration file,
+    and the cache is used as long as this status is exactly the same
+    """
+    # stat before reading: a concurrent modification then invalidates the cache
+    cfg_stat = os.stat(CFG_FILE)
+    cfg_status = (cfg_stat.st_mtime_ns, cfg_stat.st_size, cfg_stat.st_ino)
+    try:
+        with open(CFG_CACHE_FILE, mode="rb") as cachefile:
+            cache_status, config = pickle.load(cachefile)
+        if cache_status == cfg_status:
+            return config
+    except Exception:  # pylint: disable=broad-except
+        pass  # no usable cache (missing, unreadable or corrupted), rebuild it
+
+    with open(CFG_FILE, mode="r") as cfgfile:
+        config = yaml.load(cfgfile, Loader=yaml.CSafeLoader)
+
+    # write the cache atomically, so that a concurrent run never reads a partial one
+    tmp_file = CFG_CACHE_FILE + ".tmp"
+    try:
+        with open(tmp_file, mode="wb") as cachefile:
+            pickle.dump((cfg_status, config), cachefile, protocol=5)
+        os.rename(tmp_file, CFG_CACHE_FILE)
+    except OSError:
+        pass  # the cache is optional
+    return config
+
+
+def log(msg: str, file=None) -> None:
+    """
+    Print the provided message (on stdout by default)
+    """
+    with OUTPUT_LOCK:
+        print(msg, file=file)
 
 
 def system_run(args) -> None:
@@ -357,18 +558,104 @@ def system_run(args) -> None:
     Run the provided command
     """
     if DEBUG:
-        print(f"DBG: system_run '{' '.join(args)}'")
+        log(f"DBG: system_run '{' '.join(args)}'")
     else:
         subprocess.run(args, check=True)
 
 
-def main():  # pylint: disable=too-many-locals
+def process_volume(
+    btrfs_root: str,
+    btrfs_snaps: str,
+    volume_cfg: collections.ChainMap,
+    now: datetime.datetime,
+    now_local: datetime.datetime,
+) -> None:
+    """
+    Take a new snapshot of a volume if needed, and delete its old snapshots
+    """
+    # get all snapshots
+    btrfs_snaps_vol = os.path.join(btrfs_snaps, volume_cfg["path"])
+    snap_collection = ExistingSnapshotsCollection()
+    ioctl_supported = True
+    listed_names = []  # snapshots whose creation time is given by the btrfs command
+    with os.scandir(btrfs_snaps_vol) as entries:
+        for entry in entries:
+            # skip stray files (snapshots are directories)
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            snap_ts = parse_snapshot_name(entry.name)
+            if snap_ts is None:
+                # not named by snapbtrfs: get creation time from btrfs
+                # a plain directory would get the otime of its enclosing subvolume
+                # (not DirEntry.inode(): readdir gives the subvolume id instead)
+                inode = entry.stat(follow_symlinks=False).st_ino
+                if inode != BTRFS_FIRST_FREE_OBJECTID:
+                    raise RuntimeError(f"{entry.path} is not a btrfs subvolume")
+                if ioctl_supported:
+                    snap_ts = get_snapshot_creation_time(entry.path)
+                    # ioctl not available (Linux < 4.18): use the btrfs command,
+                    # for all the remaining snapshots at once
+                    ioctl_supported = snap_ts is not None
+                if snap_ts is None:
+                    listed_names.append(entry.name)
+                    continue
+            snap_collection.add(ExistingSnapshot(path=entry.path, ts=snap_ts))
+    if listed_names:
+        snap_collection.extend(
+            ExistingSnapshot(path=os.path.join(btrfs_snaps_vol, name), ts=snap_ts)
+            for name, snap_ts in zip(
+                listed_names,
+                get_snapshots_creation_time(btrfs_root, btrfs_snaps_vol, listed_names),
+            )
+        )
+    # sort once and freeze, before all the lookups
+    snap_collection.freeze()
+
+    # check if a new snapshot has to be taken
+    enabled_periods = tuple(
+        period for period in PERIOD_KEYS if volume_cfg.get(period, 0) > 0
+    )
+    if all(
+        snap_collection.has_snapshop_in_last_period(now, period)
+        for period in enabled_periods
+    ):
+        return
+
+    # determine which shall be kept / deleted
+    for period in enabled_periods:
+        snap_collection.mark_period(now, period, volume_cfg[period])
+
+    # perform snapshot
+    new_snap_path = os.path.join(
+        btrfs_snaps_vol, now_local.strftime(SNAPSHOT_NAME_FORMAT)
+    )
+    log(f"Taking snapshot {new_snap_path}")
+    system_run(
+        [
+            "btrfs",
+            "subvolume",
+            "snapshot",
+            "-r",
+            os.path.join(btrfs_root, volume_cfg["path"]),
+            new_snap_path,
+        ]
+    )
+
+    # delete snapshots to be deleted, with a single btrfs command
+    # ("--": no snapshot path can be taken as an option)
+    victims = [snap.path for snap in snap_collection.collection if not snap.is_kept]
+    for victim in victims:
+        log(f"Deleting snapshot {victim}")
+    if victims:
+        system_run(["btrfs", "subvolume", "delete", "--"] + victims)
+
+
+def main():
     """
     snapbtrfs main function
     """
     # read configuration
-    with open(CFG_FILE, mode="r") as cfgfile:
-        config = yaml.load(cfgfile, Loader=yaml.CSafeLoader)
+    config = load_config()
 
     # set umask if configured
     if config["umask"]:
@@ -378,57 +665,41 @@ def main():  # pylint: disable=too-many-locals
     now = datetime.datetime.now(datetime.timezone.utc)
     now_local = now.astimezone()
 
-    # manage each btrfs mount point
-    for btrfs_root_str, volumes in config["volumes"].items():
-        btrfs_root = pathlib.Path(btrfs_root_str)
-        btrfs_snaps = btrfs_root / config["snapshot_dir"]
-
-        # manage each configured volume
+    # get configuration of each volume, for each btrfs mount point
+    default_cfg = config.get("default", {})
+    all_volumes = []
+    for btrfs_root, volumes in config["volumes"].items():
+        btrfs_snaps = os.path.join(btrfs_root, config["snapshot_dir"])
         for volume in volumes:
-            # get volume configuration
-            # starts from 'default' configuration
-            volume_cfg = dict(config.get("default", {}))
-            # and add volume specific configuration
-            volume_cfg.update(volume)
-
-            # get all snapshots
-            btrfs_snaps_vol = btrfs_snaps / volume_cfg["path"]
-            snap_collection = ExistingSnapshotsCollection()
-            for snap_file in os.listdir(btrfs_snaps_vol):
-                snap_collection.add(ExistingSnapshot(path=btrfs_snaps_vol / snap_file))
-
-            # check if a new snapshot has to be taken
-            if not all(
-                snap_collection.has_snapshop_in_last_period(now, period)
-                for period in PERIOD_KEYS
-                if volume_cfg.get(period, 0) > 0
-            ):
-                # determine which shall be kept / deleted
-                for period in PERIOD_KEYS:
-                    if period in volume_cfg:
-                        snap_collection.mark_period(now, period, volume_cfg[period])
-
-                # perform snapshot
-                new_snap_path = btrfs_snaps_vol / f"{now_local:%F-%T}"
-                print(f"Taking snapshot {new_snap_path}")
-                system_run(
-                    [
-                        "btrfs",
-                        "subvolume",
-                        "snapshot",
-                        "-r",
-                        (btrfs_root / volume_cfg["path"]).as_posix(),
-                        new_snap_path.as_posix(),
-                    ]
-                )
-
-                # delete snapshots to be deleted
-                for snap in snap_collection.collection:
-                    if not snap.is_kept:
-                        print(f"Deleting snapshot {snap.path}")
-                        system_run(
-                            ["btrfs", "subvolume", "delete", snap.path.as_posix()]
-                        )
+            # volume specific configuration, on top of 'default' configuration
+            volume_cfg = collections.ChainMap(volume, default_cfg)
+            all_volumes.append((btrfs_root, btrfs_snaps, volume_cfg))
+
+    # manage the volumes in parallel: they are independent, and processing them is
+    # mostly waiting for the filesystem and the btrfs commands
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, min(MAX_WORKERS, len(all_volumes)))
+    ) as executor:
+        futures = [
+            executor.submit(process_volume, *volume, now, now_local)
+            for volume in all_volumes
+        ]
+
+    # report the failure of each volume, not only the first one
+    nb_failed = 0
+    for (btrfs_root, _, volume_cfg), future in zip(all_volumes, futures):
+        exc = future.exception()
+        if exc is not None:
+            nb_failed += 1
+            log(
+                f"ERROR: volume {os.path.join(btrfs_root, volume_cfg['path'])}:\n"
+                + "".join(
+                    traceback.format_exception(type(exc), exc, exc.__traceback__)
+                ),
+                file=sys.stderr,
+            )
+    if nb_failed:
+        sys.exit(f"ERROR: {nb_failed} volume(s) failed")
 
 
 if __name__ == "__main__":
@@ -22,535 +22,808 @@ Test snapbtrfs methods
 """
 
 import collections
+import contextlib
 import datetime
+import errno
+import io
+import operator
+import os
+import struct
+import subprocess
+import tempfile
+import time
 import unittest
+import unittest.mock
 
 import snapbtrfs
 
+UTC = datetime.timezone.utc
 
-class DateTimeUtilTest(unittest.TestCase):
+TestEntry = collections.namedtuple("TestEntry", "ts expected_result")
+NameEntry = collections.namedtuple("NameEntry", "name expected_result")
+WindowEntry = collections.namedtuple("WindowEntry", "begin end expected_result")
+
+ROUND_BEGINNING_HOUR_TESTS = (
+    TestEntry(
+        datetime.datetime(2019, 12, 26, 14, 2, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 12, 26, 14, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 12, 26, 14, tzinfo=UTC),
+        datetime.datetime(2019, 12, 26, 14, tzinfo=UTC),
+    ),
+)
+
+ROUND_BEGINNING_DAY_TESTS = (
+    TestEntry(
+        datetime.datetime(2019, 12, 26, 14, 2, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 12, 25, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 12, 10, 23, tzinfo=UTC),
+        datetime.datetime(2019, 12, 10, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 8, 26, 14, 2, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 8, 25, 22, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 8, 10, 22, tzinfo=UTC),
+        datetime.datetime(2019, 8, 10, 22, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 3, 31, 6, 12, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 3, 30, 23, tzinfo=UTC),
+    ),  # DST spring
+    TestEntry(
+        datetime.datetime(2019, 10, 27, 6, 12, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 10, 26, 22, tzinfo=UTC),
+    ),  # DST fall
+)
+
+ROUND_BEGINNING_MONTH_TESTS = (
+    TestEntry(
+        datetime.datetime(2019, 12, 26, 14, 2, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 11, 30, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 11, 30, 23, tzinfo=UTC),
+        datetime.datetime(2019, 11, 30, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 8, 26, 14, 2, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 7, 31, 22, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 7, 31, 22, tzinfo=UTC),
+        datetime.datetime(2019, 7, 31, 22, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 3, 31, 6, 12, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 2, 28, 23, tzinfo=UTC),
+    ),  # DST spring
+    TestEntry(
+        datetime.datetime(2019, 3, 3, 6, 12, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 2, 28, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 10, 27, 6, 12, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 9, 30, 22, tzinfo=UTC),
+    ),  # DST fall
+    TestEntry(
+        datetime.datetime(2019, 10, 7, 6, 12, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 9, 30, 22, tzinfo=UTC),
+    ),
+)
+
+ROUND_BEGINNING_WEEK_TESTS = (
+    TestEntry(
+        datetime.datetime(2019, 12, 26, 14, 2, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 12, 22, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 12, 22, 23, tzinfo=UTC),
+        datetime.datetime(2019, 12, 22, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 3, 31, 6, 12, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 3, 24, 23, tzinfo=UTC),
+    ),  # DST spring
+    TestEntry(
+        datetime.datetime(2019, 3, 29, 6, 12, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 3, 24, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 10, 27, 6, 12, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 10, 20, 22, tzinfo=UTC),
+    ),  # DST fall
+    TestEntry(
+        datetime.datetime(2019, 10, 27, 0, 12, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 10, 20, 22, tzinfo=UTC),
+    ),
+)
+
+ROUND_BEGINNING_YEAR_TESTS = (
+    TestEntry(
+        datetime.datetime(2019, 12, 26, 14, 2, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2018, 12, 31, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2018, 12, 31, 23, tzinfo=UTC),
+        datetime.datetime(2018, 12, 31, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 8, 26, 14, 2, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2018, 12, 31, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 7, 31, 22, tzinfo=UTC),
+        datetime.datetime(2018, 12, 31, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 3, 31, 6, 12, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2018, 12, 31, 23, tzinfo=UTC),
+    ),  # DST spring
+    TestEntry(
+        datetime.datetime(2019, 3, 3, 6, 12, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2018, 12, 31, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 10, 27, 6, 12, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2018, 12, 31, 23, tzinfo=UTC),
+    ),  # DST fall
+    TestEntry(
+        datetime.datetime(2019, 10, 7, 6, 12, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2018, 12, 31, 23, tzinfo=UTC),
+    ),
+)
+
+PREV_HOUR_TESTS = (
+    TestEntry(
+        datetime.datetime(2019, 12, 26, 14, 2, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 12, 26, 14, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 12, 26, 14, tzinfo=UTC),
+        datetime.datetime(2019, 12, 26, 13, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 12, 26, 0, tzinfo=UTC),
+        datetime.datetime(2019, 12, 25, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 12, 25, 23, tzinfo=UTC),
+        datetime.datetime(2019, 12, 25, 22, tzinfo=UTC),
+    ),
+)
+
+PREV_DAY_TESTS = (
+    TestEntry(
+        datetime.datetime(2019, 12, 26, 14, 2, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 12, 25, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 12, 10, 23, tzinfo=UTC),
+        datetime.datetime(2019, 12, 9, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 8, 26, 14, 2, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 8, 25, 22, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 8, 10, 22, tzinfo=UTC),
+        datetime.datetime(2019, 8, 9, 22, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 3, 31, 22, tzinfo=UTC),
+        datetime.datetime(2019, 3, 30, 23, tzinfo=UTC),
+    ),  # DST spring
+    TestEntry(
+        datetime.datetime(2019, 10, 27, 23, tzinfo=UTC),
+        datetime.datetime(2019, 10, 26, 22, tzinfo=UTC),
+    ),  # DST fall
+)
+
+PREV_WEEK_TESTS = (
+    TestEntry(
+        datetime.datetime(2019, 12, 26, 14, 2, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 12, 22, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 12, 22, 23, tzinfo=UTC),
+        datetime.datetime(2019, 12, 15, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 10, 27, 23, tzinfo=UTC),
+        datetime.datetime(2019, 10, 20, 22, tzinfo=UTC),
+    ),  # DST fall
+    TestEntry(
+        datetime.datetime(2019, 3, 31, 22, tzinfo=UTC),
+        datetime.datetime(2019, 3, 24, 23, tzinfo=UTC),
+    ),  # DST spring
+    TestEntry(
+        datetime.datetime(2019, 1, 6, 23, tzinfo=UTC),
+        datetime.datetime(2018, 12, 30, 23, tzinfo=UTC),
+    ),
+)
+
+PREV_MONTH_TESTS = (
+    TestEntry(
+        datetime.datetime(2019, 12, 26, 14, 2, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2019, 11, 30, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 11, 30, 23, tzinfo=UTC),
+        datetime.datetime(2019, 10, 31, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2019, 10, 31, 23, tzinfo=UTC),
+        datetime.datetime(2019, 9, 30, 22, tzinfo=UTC),
+    ),  # DST fall
+    TestEntry(
+        datetime.datetime(2019, 3, 31, 22, tzinfo=UTC),
+        datetime.datetime(2019, 2, 28, 23, tzinfo=UTC),
+    ),  # DST spring
+    TestEntry(
+        datetime.datetime(2019, 1, 31, 23, tzinfo=UTC),
+        datetime.datetime(2018, 12, 31, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2018, 12, 31, 23, tzinfo=UTC),
+        datetime.datetime(2018, 11, 30, 23, tzinfo=UTC),
+    ),
+)
+
+PREV_YEAR_TESTS = (
+    TestEntry(
+        datetime.datetime(2019, 12, 26, 14, 2, 42, 123456, tzinfo=UTC),
+        datetime.datetime(2018, 12, 31, 23, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2018, 12, 31, 23, tzinfo=UTC),
+        datetime.datetime(2017, 12, 31, 23, tzinfo=UTC),
+    ),
+)
+
+# America/Sao_Paulo: DST started at midnight on 2017-10-15 (00:00 -03 -> 01:00 -02)
+SAO_PAULO_ROUND_BEGINNING_DAY_TESTS = (
+    TestEntry(
+        datetime.datetime(2017, 10, 15, 12, tzinfo=UTC),
+        datetime.datetime(2017, 10, 15, 3, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2017, 10, 15, 3, tzinfo=UTC),
+        datetime.datetime(2017, 10, 15, 3, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2017, 10, 15, 2, 30, tzinfo=UTC),
+        datetime.datetime(2017, 10, 14, 3, tzinfo=UTC),
+    ),
+)
+
+SAO_PAULO_PREV_DAY_TESTS = (
+    TestEntry(
+        datetime.datetime(2017, 10, 16, 2, tzinfo=UTC),
+        datetime.datetime(2017, 10, 15, 3, tzinfo=UTC),
+    ),
+    TestEntry(
+        datetime.datetime(2017, 10, 15, 3, tzinfo=UTC),
+        datetime.datetime(2017, 10, 14, 3, tzinfo=UTC),
+    ),
+)
+
+MarkPeriodEntry = collections.namedtuple("MarkPeriodEntry", "ts_str is_kept")
+
+# sorted by date, with the parsed snapshots built once
+MARK_PERIOD_ENTRIES = sorted(
+    (
+        MarkPeriodEntry("2019-12-26 15:02:42 +0100", False),
+        MarkPeriodEntry("2019-12-26 14:01:17 +0100", False),
+        MarkPeriodEntry("2019-12-26 13:00:24 +0100", True),
+        MarkPeriodEntry("2019-12-25 11:03:32 +0100", True),
+        MarkPeriodEntry("2019-12-24 17:47:42 +0100", False),
+        MarkPeriodEntry("2019-12-24 04:47:42 +0100", True),
+        MarkPeriodEntry("2019-12-22 07:47:42 +0100", True),
+        MarkPeriodEntry("2019-12-16 09:47:42 +0100", True),
+        MarkPeriodEntry("2019-12-15 19:47:42 +0100", False),
+        MarkPeriodEntry("2019-12-13 10:47:42 +0100", False),
+        MarkPeriodEntry("2019-12-01 07:52:42 +0100", False),
+        MarkPeriodEntry("2019-11-07 08:07:42 +0100", False),
+    ),
+    key=operator.itemgetter(0),
+)
+MARK_PERIOD_SNAPS = tuple(
+    snapbtrfs.ExistingSnapshot(ts_str=entry.ts_str) for entry in MARK_PERIOD_ENTRIES
+)
+
+
+# localtime dependent helper functions, memoized
+MEMOIZED_HELPERS = (
+    snapbtrfs.round_beginning_day,
+    snapbtrfs.round_beginning_week,
+    snapbtrfs.round_beginning_month,
+    snapbtrfs.round_beginning_year,
+    snapbtrfs.prev_day,
+    snapbtrfs.prev_week,
+    snapbtrfs.prev_month,
+    snapbtrfs.prev_year,
+)
+
+
+def make_helper_test(func, tst: TestEntry):
     """
-    Unit tests for class DateTimeUtil
+    Make a test method checking func(tst.ts) == tst.expected_result
     """
 
-    def test_round_beginning_hour(self):
+    def test(self):
+        self.assertEqual(func(tst.ts), tst.expected_result)
+
+    test.__doc__ = f"Test {func.__name__}({tst.ts})"
+    return test
+
+
+class DateTimeHelpersTest(unittest.TestCase):
+    """
+    Unit tests for datetime helper functions
+    One test method is generated for each entry of the test tables
+    """
+
+
+for helper, helper_tests in (
+    (snapbtrfs.round_beginning_hour, ROUND_BEGINNING_HOUR_TESTS),
+    (snapbtrfs.round_beginning_day, ROUND_BEGINNING_DAY_TESTS),
+    (snapbtrfs.round_beginning_month, ROUND_BEGINNING_MONTH_TESTS),
+    (snapbtrfs.round_beginning_week, ROUND_BEGINNING_WEEK_TESTS),
+    (snapbtrfs.round_beginning_year, ROUND_BEGINNING_YEAR_TESTS),
+    (snapbtrfs.prev_hour, PREV_HOUR_TESTS),
+    (snapbtrfs.prev_day, PREV_DAY_TESTS),
+    (snapbtrfs.prev_week, PREV_WEEK_TESTS),
+    (snapbtrfs.prev_month, PREV_MONTH_TESTS),
+    (snapbtrfs.prev_year, PREV_YEAR_TESTS),
+):
+    for index, helper_test in enumerate(helper_tests):
+        setattr(
+            DateTimeHelpersTest,
+            f"test_{helper.__name__}_{index}",
+            make_helper_test(helper, helper_test),
+        )
+
+
+class MemoizedHelpersTest(unittest.TestCase):
+    """
+    Unit tests for the memoization of the localtime dependent helper functions
+    """
+
+    def test_same_instant_in_other_tzinfo(self):
         """
-        Test DateTimeUtil.round_beginning_hour()
+        Test that the result is expressed in the tzinfo of each argument
         """
-        TestEntry = collections.namedtuple("TestEntry", "ts expected_result")
-        tests = (
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    12,
-                    26,
-                    14,
-                    2,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
-                ),
-                datetime.datetime(2019, 12, 26, 14, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 12, 26, 14, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 12, 26, 14, tzinfo=datetime.timezone.utc),
-            ),
+        ts_utc = datetime.datetime(2019, 12, 26, 14, tzinfo=UTC)
+        ts_local = ts_utc.astimezone()
+        for func in MEMOIZED_HELPERS:
+            func.cache_clear()
+            for ts in (ts_utc, ts_local, ts_utc):
+                msg = f"{func.__name__}({ts})"
+                result = func(ts)
+                self.assertIs(result.tzinfo, ts.tzinfo, msg=msg)
+                self.assertEqual(result.utcoffset(), ts.utcoffset(), msg=msg)
+        self.assertEqual(
+            snapbtrfs.round_beginning_day(ts_local),
+            datetime.datetime(2019, 12, 26, tzinfo=ts_local.tzinfo),
         )
-        for tst in tests:
-            with self.subTest(tst=tst):
-                self.assertEqual(
-                    snapbtrfs.DateTimeUtil.round_beginning_hour(tst.ts),
-                    tst.expected_result,
-                )
 
-    def test_round_beginning_day(self):
+
+class MidnightDstSwitchTest(unittest.TestCase):
+    """
+    Unit tests for datetime helper functions, in a timezone switching DST at
+    midnight
+    One test method is generated for each entry of the test tables
+    """
+
+    def setUp(self):
+        patcher = unittest.mock.patch.dict(os.environ, TZ="America/Sao_Paulo")
+        patcher.start()
+        self.addCleanup(self.reset_timezone)
+        self.addCleanup(patcher.stop)
+        self.reset_timezone()
+
+    @staticmethod
+    def reset_timezone():
         """
-        Test DateTimeUtil.round_beginning_day()
+        Apply TZ, and forget the boundaries memoized for the previous timezone
         """
-        TestEntry = collections.namedtuple("TestEntry", "ts expected_result")
-        tests = (
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    12,
-                    26,
-                    14,
-                    2,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
-                ),
-                datetime.datetime(2019, 12, 25, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 12, 10, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 12, 10, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(
-                    2019, 8, 26, 14, 2, 42, 123456, tzinfo=datetime.timezone.utc
-                ),
-                datetime.datetime(2019, 8, 25, 22, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 8, 10, 22, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 8, 10, 22, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(
-                    2019, 3, 31, 6, 12, 42, 123456, tzinfo=datetime.timezone.utc
-                ),
-                datetime.datetime(2019, 3, 30, 23, tzinfo=datetime.timezone.utc),
-            ),  # DST spring
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    10,
-                    27,
-                    6,
-                    12,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
-                ),
-                datetime.datetime(2019, 10, 26, 22, tzinfo=datetime.timezone.utc),
-            ),  # DST fall
+        time.tzset()
+        for func in MEMOIZED_HELPERS:
+            func.cache_clear()
+
+
+for helper, helper_tests in (
+    (snapbtrfs.round_beginning_day, SAO_PAULO_ROUND_BEGINNING_DAY_TESTS),
+    (snapbtrfs.prev_day, SAO_PAULO_PREV_DAY_TESTS),
+):
+    for index, helper_test in enumerate(helper_tests):
+        setattr(
+            MidnightDstSwitchTest,
+            f"test_{helper.__name__}_{index}",
+            make_helper_test(helper, helper_test),
         )
-        for tst in tests:
-            with self.subTest(tst=tst):
-                self.assertEqual(
-                    snapbtrfs.DateTimeUtil.round_beginning_day(tst.ts),
-                    tst.expected_result,
-                )
 
-    def test_round_beginning_month(self):
+
+class ParseSnapshotNameTest(unittest.TestCase):
+    """
+    Unit tests for parse_snapshot_name()
+    """
+
+    def test_parse_snapshot_name(self):
         """
-        Test DateTimeUtil.round_beginning_month()
+        Test parse_snapshot_name()
         """
-        TestEntry = collections.namedtuple("TestEntry", "ts expected_result")
         tests = (
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    12,
-                    26,
-                    14,
-                    2,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
-                ),
-                datetime.datetime(2019, 11, 30, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 11, 30, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 11, 30, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(
-                    2019, 8, 26, 14, 2, 42, 123456, tzinfo=datetime.timezone.utc
-                ),
-                datetime.datetime(2019, 7, 31, 22, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 7, 31, 22, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 7, 31, 22, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(
-                    2019, 3, 31, 6, 12, 42, 123456, tzinfo=datetime.timezone.utc
-                ),
-                datetime.datetime(2019, 2, 28, 23, tzinfo=datetime.timezone.utc),
-            ),  # DST spring
-            TestEntry(
-                datetime.datetime(
-                    2019, 3, 3, 6, 12, 42, 123456, tzinfo=datetime.timezone.utc
-                ),
-                datetime.datetime(2019, 2, 28, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    10,
-                    27,
-                    6,
-                    12,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
-                ),
-                datetime.datetime(2019, 9, 30, 22, tzinfo=datetime.timezone.utc),
-            ),  # DST fall
-            TestEntry(
-                datetime.datetime(
-                    2019, 10, 7, 6, 12, 42, 123456, tzinfo=datetime.timezone.utc
-                ),
-                datetime.datetime(2019, 9, 30, 22, tzinfo=datetime.timezone.utc),
-            ),
+            NameEntry(
+                "2019-12-26-15:02:42",
+                datetime.datetime(2019, 12, 26, 14, 2, 42, tzinfo=UTC),
+            ),
+            NameEntry(
+                "2019-08-26-15:02:42",
+                datetime.datetime(2019, 8, 26, 13, 2, 42, tzinfo=UTC),
+            ),  # DST
+            NameEntry("2019-12-26 15:02:42", None),
+            NameEntry("2019-13-26-15:02:42", None),
+            NameEntry("manual_snapshot", None),
         )
-        for tst in tests:
-            with self.subTest(tst=tst):
-                self.assertEqual(
-                    snapbtrfs.DateTimeUtil.round_beginning_month(tst.ts),
-                    tst.expected_result,
-                )
+        for index, tst in enumerate(tests):
+            self.assertEqual(
+                snapbtrfs.parse_snapshot_name(tst.name),
+                tst.expected_result,
+                msg=f"[{index}] name={tst.name}",
+            )
 
-    def test_round_beginning_week(self):
+
+class LoadConfigTest(unittest.TestCase):
+    """
+    Unit tests for load_config() and its cache
+    """
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmp_dir.cleanup)
+        self.cfg_file = os.path.join(tmp_dir.name, "snapbtrfs.conf.yaml")
+        for name, value in (
+            ("CFG_FILE", self.cfg_file),
+            ("CFG_CACHE_FILE", self.cfg_file + ".cache.pkl"),
+        ):
+            patcher = unittest.mock.patch.object(snapbtrfs, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_config(self, content: str, mtime_ns: int) -> None:
         """
-        Test DateTimeUtil.round_beginning_week()
+        Replace the configuration file, with the given modification time
         """
-        TestEntry = collections.namedtuple("TestEntry", "ts expected_result")
-        tests = (
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    12,
-                    26,
-                    14,
-                    2,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
-                ),
-                datetime.datetime(2019, 12, 22, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 12, 22, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 12, 22, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(
-                    2019, 3, 31, 6, 12, 42, 123456, tzinfo=datetime.timezone.utc
-                ),
-                datetime.datetime(2019, 3, 24, 23, tzinfo=datetime.timezone.utc),
-            ),  # DST spring
-            TestEntry(
-                datetime.datetime(
-                    2019, 3, 29, 6, 12, 42, 123456, tzinfo=datetime.timezone.utc
-                ),
-                datetime.datetime(2019, 3, 24, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    10,
-                    27,
-                    6,
-                    12,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
-                ),
-                datetime.datetime(2019, 10, 20, 22, tzinfo=datetime.timezone.utc),
-            ),  # DST fall
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    10,
-                    27,
-                    0,
-                    12,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
-                ),
-                datetime.datetime(2019, 10, 20, 22, tzinfo=datetime.timezone.utc),
+        tmp_file = self.cfg_file + ".new"
+        with open(tmp_file, mode="w") as cfgfile:
+            cfgfile.write(content)
+        os.utime(tmp_file, ns=(mtime_ns, mtime_ns))
+        os.rename(tmp_file, self.cfg_file)
+
+    def test_cache_hit(self):
+        """
+        Test that an unchanged configuration is read from the cache
+        """
+        self.write_config("umask: 0o022\n", 1_600_000_000_000_000_000)
+        self.assertEqual(snapbtrfs.load_config(), {"umask": "0o022"})
+        with unittest.mock.patch.object(snapbtrfs.yaml, "load") as yaml_load:
+            self.assertEqual(snapbtrfs.load_config(), {"umask": "0o022"})
+        yaml_load.assert_not_called()
+
+    def test_cache_rebuild(self):
+        """
+        Test that a replaced configuration is read again, even if older
+        """
+        self.write_config("umask: 0o022\n", 1_600_000_000_000_000_000)
+        self.assertEqual(snapbtrfs.load_config(), {"umask": "0o022"})
+        self.write_config("umask: 0o077\n", 1_500_000_000_000_000_000)
+        self.assertEqual(snapbtrfs.load_config(), {"umask": "0o077"})
+        self.assertEqual(snapbtrfs.load_config(), {"umask": "0o077"})
+
+
+class GetSnapshotCreationTimeTest(unittest.TestCase):
+    """
+    Unit tests for get_snapshot_creation_time(), with the ioctl mocked
+    """
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = tmp_dir.name
+
+    def test_otime(self):
+        """
+        Test decoding of the otime field of btrfs_ioctl_get_subvol_info_args
+        """
+
+        def ioctl(_, request, buf):
+            self.assertEqual(request, snapbtrfs.BTRFS_IOC_GET_SUBVOL_INFO)
+            self.assertEqual(len(buf), snapbtrfs.BTRFS_SUBVOL_INFO_SIZE)
+            # struct btrfs_ioctl_timespec is 16 bytes long (with padding)
+            struct.pack_into("=QI", buf, 376, 1, 2)  # ctime
+            struct.pack_into("=QI", buf, 392, 1577368962, 123456789)  # otime
+            struct.pack_into("=QI", buf, 408, 3, 4)  # stime
+
+        with unittest.mock.patch.object(snapbtrfs.fcntl, "ioctl", ioctl):
+            self.assertEqual(
+                snapbtrfs.get_snapshot_creation_time(self.path),
+                datetime.datetime(2019, 12, 26, 14, 2, 42, 123456, tzinfo=UTC),
+            )
+
+    def test_ioctl_not_supported(self):
+        """
+        Test get_snapshot_creation_time() on a kernel without the ioctl
+        """
+        with unittest.mock.patch.object(
+            snapbtrfs.fcntl, "ioctl", side_effect=OSError(errno.ENOTTY, "")
+        ):
+            self.assertIsNone(snapbtrfs.get_snapshot_creation_time(self.path))
+
+
+# captured output of 'LANG=C btrfs subvolume list -o -s -t /mnt/btrfs/snapshots/home'
+BTRFS_LIST_OUTPUT = (
+    b"ID\tgen\tcgen\ttop level\totime\tpath\t\n"
+    b"--\t---\t----\t---------\t-----\t----\t\n"
+    b"261\t1834\t1834\t5\t\t2019-12-24 18:30:12\tsnapshots/home/before upgrade\n"
+    b"262\t1901\t1901\t5\t\t2019-08-26 15:02:42\tsnapshots/home/manual\n"
+    b"263\t1902\t1902\t5\t\t2019-12-26 15:00:01\tsnapshots/home/2019-12-26-15:00:01\n"
+)
+
+
+class GetSnapshotsCreationTimeTest(unittest.TestCase):
+    """
+    Unit tests for get_snapshots_creation_time(), on captured btrfs output
+    """
+
+    def setUp(self):
+        patcher = unittest.mock.patch.object(
+            snapbtrfs.subprocess,
+            "run",
+            return_value=subprocess.CompletedProcess(
+                args=(), returncode=0, stdout=BTRFS_LIST_OUTPUT, stderr=b""
             ),
         )
-        for tst in tests:
-            with self.subTest(tst=tst):
-                self.assertEqual(
-                    snapbtrfs.DateTimeUtil.round_beginning_week(tst.ts),
-                    tst.expected_result,
-                )
+        self.run = patcher.start()
+        self.addCleanup(patcher.stop)
 
-    def test_round_beginning_year(self):
+    def test_creation_times(self):
         """
-        Test DateTimeUtil.round_beginning_year()
+        Test get_snapshots_creation_time() with listed snapshots
         """
-        TestEntry = collections.namedtuple("TestEntry", "ts expected_result")
-        tests = (
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    12,
-                    26,
-                    14,
-                    2,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
-                ),
-                datetime.datetime(2018, 12, 31, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2018, 12, 31, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2018, 12, 31, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(
-                    2019, 8, 26, 14, 2, 42, 123456, tzinfo=datetime.timezone.utc
-                ),
-                datetime.datetime(2018, 12, 31, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 7, 31, 22, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2018, 12, 31, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(
-                    2019, 3, 31, 6, 12, 42, 123456, tzinfo=datetime.timezone.utc
-                ),
-                datetime.datetime(2018, 12, 31, 23, tzinfo=datetime.timezone.utc),
-            ),  # DST spring
-            TestEntry(
-                datetime.datetime(
-                    2019, 3, 3, 6, 12, 42, 123456, tzinfo=datetime.timezone.utc
-                ),
-                datetime.datetime(2018, 12, 31, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    10,
-                    27,
-                    6,
-                    12,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
-                ),
-                datetime.datetime(2018, 12, 31, 23, tzinfo=datetime.timezone.utc),
-            ),  # DST fall
-            TestEntry(
-                datetime.datetime(
-                    2019, 10, 7, 6, 12, 42, 123456, tzinfo=datetime.timezone.utc
-                ),
-                datetime.datetime(2018, 12, 31, 23, tzinfo=datetime.timezone.utc),
-            ),
+        self.assertEqual(
+            snapbtrfs.get_snapshots_creation_time(
+                "/mnt/btrfs", "/mnt/btrfs/snapshots/home", ["manual", "before upgrade"]
+            ),
+            [
+                datetime.datetime(2019, 8, 26, 13, 2, 42, tzinfo=UTC),  # DST
+                datetime.datetime(2019, 12, 24, 17, 30, 12, tzinfo=UTC),
+            ],
+        )
+        self.assertEqual(
+            self.run.call_args.args[0],
+            [
+                "btrfs",
+                "subvolume",
+                "list",
+                "-o",
+                "-s",
+                "-t",
+                "/mnt/btrfs/snapshots/home",
+            ],
         )
-        for tst in tests:
-            with self.subTest(tst=tst):
-                self.assertEqual(
-                    snapbtrfs.DateTimeUtil.round_beginning_year(tst.ts),
-                    tst.expected_result,
-                )
 
-    def test_prev_hour(self):
+    def test_missing_snapshot(self):
         """
-        Test DateTimeUtil.prev_hour()
+        Test get_snapshots_creation_time() with a snapshot not listed by btrfs
         """
-        TestEntry = collections.namedtuple("TestEntry", "ts expected_result")
-        tests = (
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    12,
-                    26,
-                    14,
-                    2,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
-                ),
-                datetime.datetime(2019, 12, 26, 14, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 12, 26, 14, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 12, 26, 13, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 12, 26, 0, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 12, 25, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 12, 25, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 12, 25, 22, tzinfo=datetime.timezone.utc),
-            ),
+        with self.assertRaisesRegex(RuntimeError, "not_a_snapshot"):
+            snapbtrfs.get_snapshots_creation_time(
+                "/mnt/btrfs", "/mnt/btrfs/snapshots/home", ["manual", "not_a_snapshot"]
+            )
+
+
+# os.scandir, before being patched by scandir_subvolumes
+SCANDIR = os.scandir
+
+
+class SubvolumeEntry:
+    """
+    os.DirEntry of a directory, seen as the root directory of a btrfs subvolume
+    """
+
+    def __init__(self, entry: os.DirEntry):
+        self.entry = entry
+
+    def __getattr__(self, name: str):
+        return getattr(self.entry, name)
+
+    def stat(self, follow_symlinks: bool = True):  # pylint: disable=unused-argument
+        """
+        Return the stat of a subvolume root directory (inode number only)
+        """
+        return unittest.mock.Mock(st_ino=snapbtrfs.BTRFS_FIRST_FREE_OBJECTID)
+
+
+@contextlib.contextmanager
+def scandir_subvolumes(path: str):
+    """
+    os.scandir, with all the directories seen as btrfs subvolumes
+    """
+    with SCANDIR(path) as entries:
+        yield [SubvolumeEntry(entry) for entry in entries]
+
+
+class ProcessVolumeTest(unittest.TestCase):
+    """
+    Unit tests for process_volume(), with the btrfs accesses mocked
+    """
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmp_dir.cleanup)
+        self.btrfs_root = tmp_dir.name
+        self.btrfs_snaps = os.path.join(self.btrfs_root, "snapshots")
+        self.btrfs_snaps_vol = os.path.join(self.btrfs_snaps, "home")
+        # snapshot not named by snapbtrfs, and one named in localtime (11:30 UTC)
+        os.makedirs(os.path.join(self.btrfs_snaps_vol, "manual"))
+        os.makedirs(os.path.join(self.btrfs_snaps_vol, "2019-12-26-12:30:00"))
+        for name in ("system_run", "log"):
+            patcher = unittest.mock.patch.object(snapbtrfs, name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def process_volume(self) -> None:
+        """
+        Call process_volume() on the test volume, keeping 1 hourly snapshot
+        """
+        now = datetime.datetime(2019, 12, 26, 15, 30, tzinfo=UTC)
+        snapbtrfs.process_volume(
+            self.btrfs_root,
+            self.btrfs_snaps,
+            collections.ChainMap({"path": "home", "hourly": 1}),
+            now,
+            now.astimezone(),
         )
-        for tst in tests:
-            with self.subTest(tst=tst):
-                self.assertEqual(
-                    snapbtrfs.DateTimeUtil.prev_hour(tst.ts), tst.expected_result
-                )
 
-    def test_prev_day(self):
+    def check_deleted(self, names) -> None:
         """
-        Test DateTimeUtil.prev_day()
+        Check that a new snapshot was taken, and that the given ones were deleted
         """
-        TestEntry = collections.namedtuple("TestEntry", "ts expected_result")
-        tests = (
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    12,
-                    26,
-                    14,
-                    2,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
+        self.assertEqual(
+            self.system_run.call_args_list,
+            [
+                unittest.mock.call(
+                    [
+                        "btrfs",
+                        "subvolume",
+                        "snapshot",
+                        "-r",
+                        os.path.join(self.btrfs_root, "home"),
+                        os.path.join(self.btrfs_snaps_vol, "2019-12-26-16:30:00"),
+                    ]
                 ),
-                datetime.datetime(2019, 12, 25, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 12, 10, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 12, 9, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(
-                    2019, 8, 26, 14, 2, 42, 123456, tzinfo=datetime.timezone.utc
+                unittest.mock.call(
+                    ["btrfs", "subvolume", "delete", "--"]
+                    + [os.path.join(self.btrfs_snaps_vol, name) for name in names]
                 ),
-                datetime.datetime(2019, 8, 25, 22, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 8, 10, 22, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 8, 9, 22, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 3, 31, 22, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 3, 30, 23, tzinfo=datetime.timezone.utc),
-            ),  # DST spring
-            TestEntry(
-                datetime.datetime(2019, 10, 27, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 10, 26, 22, tzinfo=datetime.timezone.utc),
-            ),  # DST fall
+            ],
         )
-        for tst in tests:
-            with self.subTest(tst=tst):
-                self.assertEqual(
-                    snapbtrfs.DateTimeUtil.prev_day(tst.ts), tst.expected_result
-                )
 
-    def test_prev_week(self):
+    def test_not_a_subvolume(self):
         """
-        Test DateTimeUtil.prev_week()
+        Test that a directory which is not a subvolume is rejected
         """
-        TestEntry = collections.namedtuple("TestEntry", "ts expected_result")
-        tests = (
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    12,
-                    26,
-                    14,
-                    2,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
-                ),
-                datetime.datetime(2019, 12, 22, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 12, 22, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 12, 15, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 10, 27, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 10, 20, 22, tzinfo=datetime.timezone.utc),
-            ),  # DST fall
-            TestEntry(
-                datetime.datetime(2019, 3, 31, 22, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 3, 24, 23, tzinfo=datetime.timezone.utc),
-            ),  # DST spring
-            TestEntry(
-                datetime.datetime(2019, 1, 6, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2018, 12, 30, 23, tzinfo=datetime.timezone.utc),
-            ),
-        )
-        for tst in tests:
-            with self.subTest(tst=tst):
-                self.assertEqual(
-                    snapbtrfs.DateTimeUtil.prev_week(tst.ts), tst.expected_result
-                )
+        with self.assertRaisesRegex(RuntimeError, "manual is not a btrfs subvolume"):
+            self.process_volume()
+        self.system_run.assert_not_called()
 
-    def test_prev_month(self):
+    def test_ioctl(self):
         """
-        Test DateTimeUtil.prev_month()
+        Test a snapshot not named by snapbtrfs, with its creation time by ioctl
         """
-        TestEntry = collections.namedtuple("TestEntry", "ts expected_result")
-        tests = (
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    12,
-                    26,
-                    14,
-                    2,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
-                ),
-                datetime.datetime(2019, 11, 30, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 11, 30, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 10, 31, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 10, 31, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 9, 30, 22, tzinfo=datetime.timezone.utc),
-            ),  # DST fall
-            TestEntry(
-                datetime.datetime(2019, 3, 31, 22, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 2, 28, 23, tzinfo=datetime.timezone.utc),
-            ),  # DST spring
-            TestEntry(
-                datetime.datetime(2019, 1, 31, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2018, 12, 31, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2018, 12, 31, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2018, 11, 30, 23, tzinfo=datetime.timezone.utc),
-            ),
-        )
-        for tst in tests:
-            with self.subTest(tst=tst):
-                self.assertEqual(
-                    snapbtrfs.DateTimeUtil.prev_month(tst.ts), tst.expected_result
-                )
 
-    def test_prev_year(self):
+        def ioctl(_, request, buf):
+            self.assertEqual(request, snapbtrfs.BTRFS_IOC_GET_SUBVOL_INFO)
+            otime = datetime.datetime(2019, 12, 26, 12, 10, tzinfo=UTC)
+            struct.pack_into("=QI", buf, 392, int(otime.timestamp()), 0)
+
+        with unittest.mock.patch.object(
+            snapbtrfs.os, "scandir", scandir_subvolumes
+        ), unittest.mock.patch.object(snapbtrfs.fcntl, "ioctl", ioctl):
+            self.process_volume()
+        self.check_deleted(["2019-12-26-12:30:00"])
+
+    def test_list_fallback(self):
         """
-        Test DateTimeUtil.prev_year()
+        Test snapshots not named by snapbtrfs, on a kernel without the ioctl
         """
-        TestEntry = collections.namedtuple("TestEntry", "ts expected_result")
-        tests = (
-            TestEntry(
-                datetime.datetime(
-                    2019,
-                    12,
-                    26,
-                    14,
-                    2,
-                    42,
-                    123456,
-                    tzinfo=datetime.timezone.utc,
+        os.makedirs(os.path.join(self.btrfs_snaps_vol, "other"))
+        with unittest.mock.patch.object(
+            snapbtrfs.os, "scandir", scandir_subvolumes
+        ), unittest.mock.patch.object(
+            snapbtrfs.fcntl, "ioctl", side_effect=OSError(errno.ENOTTY, "")
+        ) as ioctl, unittest.mock.patch.object(
+            snapbtrfs.subprocess,
+            "run",
+            return_value=subprocess.CompletedProcess(
+                args=(),
+                returncode=0,
+                stdout=(
+                    b"ID\tgen\tcgen\ttop level\totime\tpath\t\n"
+                    b"--\t---\t----\t---------\t-----\t----\t\n"
+                    b"258\t20\t20\t5\t\t2019-12-26 13:10:00\tsnapshots/home/manual\n"
+                    b"259\t21\t21\t5\t\t2019-12-26 14:20:00\tsnapshots/home/other\n"
                 ),
-                datetime.datetime(2018, 12, 31, 23, tzinfo=datetime.timezone.utc),
-            ),
-            TestEntry(
-                datetime.datetime(2018, 12, 31, 23, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2017, 12, 31, 23, tzinfo=datetime.timezone.utc),
-            ),
-        )
-        for tst in tests:
-            with self.subTest(tst=tst):
-                self.assertEqual(
-                    snapbtrfs.DateTimeUtil.prev_year(tst.ts), tst.expected_result
-                )
+                stderr=b"",
+            ),
+        ) as run:
+            self.process_volume()
+        # ioctl only tried once, then a single btrfs command for the others
+        self.assertEqual(ioctl.call_count, 1)
+        self.assertEqual(run.call_count, 1)
+        self.check_deleted(["2019-12-26-12:30:00", "manual"])
 
 
-class ExistingSnapshotsCollectionTest(unittest.TestCase):
+def process_volume_failing(btrfs_root: str, _, volume_cfg, *__) -> None:
     """
-    Unit tests for class ExistingSnapshotsCollection
+    Mock of process_volume(), failing for all the volumes but 'var'
     """
+    if volume_cfg["path"] != "var":
+        raise OSError(f"cannot process {btrfs_root} {volume_cfg['path']}")
 
-    def test_find_oldest_in_window(self):
+
+class MainTest(unittest.TestCase):
+    """
+    Unit tests for main(), with the configuration and volume processing mocked
+    """
+
+    @unittest.mock.patch.object(
+        snapbtrfs,
+        "load_config",
+        return_value={
+            "umask": None,
+            "snapshot_dir": "snapshots",
+            "volumes": {
+                "/mnt/btrfs": [{"path": path} for path in ("home", "var", "root")]
+            },
+        },
+    )
+    @unittest.mock.patch.object(
+        snapbtrfs, "process_volume", side_effect=process_volume_failing
+    )
+    def test_failed_volumes(self, process_volume, _):
         """
-        Test ExistingSnapshotsCollection.find_oldest_in_window()
+        Test that all the volumes are processed, and all the failures reported
         """
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr), self.assertRaises(
+            SystemExit
+        ) as context:
+            snapbtrfs.main()
+        self.assertNotIn(context.exception.code, (0, None))
+        self.assertEqual(process_volume.call_count, 3)
+        for path in ("home", "root"):
+            self.assertIn(f"ERROR: volume /mnt/btrfs/{path}:", stderr.getvalue())
+            self.assertIn(
+                f"OSError: cannot process /mnt/btrfs {path}", stderr.getvalue()
+            )
+        self.assertNotIn("/mnt/btrfs/var", stderr.getvalue())
+
+
+class ExistingSnapshotsCollectionTest(unittest.TestCase):
+    """
+    Unit tests for class ExistingSnapshotsCollection
+    The collections are built once for the whole class
+    """
+
+    @classmethod
+    def setUpClass(cls):
         existing_snapshots = (
             "2019-12-26 15:02:42 +0100",
             "2019-12-26 13:00:24 +0100",
@@ -560,87 +833,89 @@ class ExistingSnapshotsCollectionTest(unittest.TestCase):
             "2019-12-26 14:01:17 +0100",
             "2019-11-07 08:02:42 +0100",
         )
-        snap_collection = snapbtrfs.ExistingSnapshotsCollection()
-        for ts_str in existing_snapshots:
-            snap_collection.add(snapbtrfs.ExistingSnapshot(ts_str=ts_str))
-        TestEntry = collections.namedtuple("TestEntry", "begin end expected_result")
+        cls.find_snap_collection = snapbtrfs.ExistingSnapshotsCollection()
+        cls.find_snap_collection.extend(
+            snapbtrfs.ExistingSnapshot(ts_str=ts_str) for ts_str in existing_snapshots
+        )
+        cls.find_snap_collection.freeze()
+        cls.mark_snap_collection = snapbtrfs.ExistingSnapshotsCollection()
+        cls.mark_snap_collection.extend(MARK_PERIOD_SNAPS)
+        cls.mark_snap_collection.freeze()
+
+    def setUp(self):
+        # mark_period() is the only mutation: reset its marks
+        for snap in self.mark_snap_collection.collection:
+            snap.is_kept = False
+
+    def test_frozen(self):
+        """
+        Test that a frozen collection refuses new snapshots
+        """
+        snap = snapbtrfs.ExistingSnapshot(ts_str="2019-12-27 10:00:00 +0100")
+        with self.assertRaises(RuntimeError):
+            self.find_snap_collection.add(snap)
+        with self.assertRaises(RuntimeError):
+            self.find_snap_collection.extend((snap,))
+        self.assertNotIn(snap, self.find_snap_collection.collection)
+
+    def test_find_oldest_in_window(self):
+        """
+        Test ExistingSnapshotsCollection.find_oldest_in_window()
+        """
         tests = (
-            TestEntry(
-                datetime.datetime(2019, 12, 26, 14, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 12, 26, 15, tzinfo=datetime.timezone.utc),
-                datetime.datetime(
-                    2019, 12, 26, 14, 2, 42, tzinfo=datetime.timezone.utc
-                ),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 12, 26, 0, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 12, 26, 15, tzinfo=datetime.timezone.utc),
-                datetime.datetime(
-                    2019, 12, 26, 12, 0, 24, tzinfo=datetime.timezone.utc
-                ),
-            ),
-            TestEntry(
-                datetime.datetime(2019, 12, 26, 0, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 12, 26, 12, tzinfo=datetime.timezone.utc),
+            WindowEntry(
+                datetime.datetime(2019, 12, 26, 14, tzinfo=UTC),
+                datetime.datetime(2019, 12, 26, 15, tzinfo=UTC),
+                datetime.datetime(2019, 12, 26, 14, 2, 42, tzinfo=UTC),
+            ),
+            WindowEntry(
+                datetime.datetime(2019, 12, 26, 0, tzinfo=UTC),
+                datetime.datetime(2019, 12, 26, 15, tzinfo=UTC),
+                datetime.datetime(2019, 12, 26, 12, 0, 24, tzinfo=UTC),
+            ),
+            WindowEntry(
+                datetime.datetime(2019, 12, 26, 0, tzinfo=UTC),
+                datetime.datetime(2019, 12, 26, 12, tzinfo=UTC),
                 None,
             ),
-            TestEntry(
-                datetime.datetime(2019, 12, 1, 0, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 12, 26, 15, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 12, 1, 6, 52, 42, tzinfo=datetime.timezone.utc),
+            WindowEntry(
+                datetime.datetime(2019, 12, 1, 0, tzinfo=UTC),
+                datetime.datetime(2019, 12, 26, 15, tzinfo=UTC),
+                datetime.datetime(2019, 12, 1, 6, 52, 42, tzinfo=UTC),
             ),
-            TestEntry(
-                datetime.datetime(2019, 12, 27, 0, tzinfo=datetime.timezone.utc),
-                datetime.datetime(2019, 12, 28, 0, tzinfo=datetime.timezone.utc),
+            WindowEntry(
+                datetime.datetime(2019, 12, 27, 0, tzinfo=UTC),
+                datetime.datetime(2019, 12, 28, 0, tzinfo=UTC),
                 None,
             ),
         )
-        for tst in tests:
-            with self.subTest(tst=tst):
-                snap = snap_collection.find_oldest_in_window(tst.begin, tst.end)
-                if tst.expected_result is None:
-                    self.assertIsNone(snap)
-                else:
-                    self.assertEqual(snap.ts, tst.expected_result)
+        for index, tst in enumerate(tests):
+            msg = f"[{index}] begin={tst.begin} end={tst.end}"
+            snap = self.find_snap_collection.find_oldest_in_window(tst.begin, tst.end)
+            if tst.expected_result is None:
+                self.assertIsNone(snap, msg=msg)
+            else:
+                self.assertIsNotNone(snap, msg=msg)
+                self.assertEqual(snap.ts, tst.expected_result, msg=msg)
 
     def test_mark_period(self):
         """
         Test ExistingSnapshotsCollection.mark_period()
         """
-        TestEntry = collections.namedtuple("TestEntry", "ts_str is_kept")
-        existing_snapshots = [
-            TestEntry("2019-12-26 15:02:42 +0100", False),
-            TestEntry("2019-12-26 14:01:17 +0100", False),
-            TestEntry("2019-12-26 13:00:24 +0100", True),
-            TestEntry("2019-12-25 11:03:32 +0100", True),
-            TestEntry("2019-12-24 17:47:42 +0100", False),
-            TestEntry("2019-12-24 04:47:42 +0100", True),
-            TestEntry("2019-12-22 07:47:42 +0100", True),
-            TestEntry("2019-12-16 09:47:42 +0100", True),
-            TestEntry("2019-12-15 19:47:42 +0100", False),
-            TestEntry("2019-12-13 10:47:42 +0100", False),
-            TestEntry("2019-12-01 07:52:42 +0100", False),
-            TestEntry("2019-11-07 08:07:42 +0100", False),
-        ]
-        existing_snapshots.sort(key=lambda entry: entry.ts_str)
-        snap_collection = snapbtrfs.ExistingSnapshotsCollection()
-        for entry in existing_snapshots:
-            snap_collection.add(snapbtrfs.ExistingSnapshot(ts_str=entry.ts_str))
+        snap_collection = self.mark_snap_collection
         snap_collection.mark_period(
-            datetime.datetime(
-                2019, 12, 26, 15, 1, 36, 123456, tzinfo=datetime.timezone.utc
-            ),
+            datetime.datetime(2019, 12, 26, 15, 1, 36, 123456, tzinfo=UTC),
             "daily",
             5,
         )
         for index in range(  # pylint: disable=consider-using-enumerate
-            len(existing_snapshots)
+            len(MARK_PERIOD_ENTRIES)
         ):
             self.assertEqual(
                 snap_collection.collection[index].ts_str,
-                existing_snapshots[index].ts_str,
+                MARK_PERIOD_ENTRIES[index].ts_str,
             )
             self.assertEqual(
                 snap_collection.collection[index].is_kept,
-                existing_snapshots[index].is_kept,
+                MARK_PERIOD_ENTRIES[index].is_kept,
             )